@@ -0,0 +1,21 @@
+# gunicorn -c gunicorn_conf.py wsgi:app
+import multiprocessing
+import os
+
+# 与 main.py 直接运行时的地址保持一致
+bind = os.getenv("BIND", "0.0.0.0:5000")
+
+# 多进程利用多核，每个进程内多线程等待 DeepSeek / SQLite IO
+# SQLite 已开启 WAL，多个读者可以与一个写者并发；连接按请求创建，不跨线程共享
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("THREADS", 8))
+
+# DeepSeek 读取超时为 30 秒，留出余量
+timeout = 60
+
+# DB_PATH 与静态文件都是相对路径
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+# 在主进程中建表/建索引一次，再 fork 出 worker
+preload_app = True
@@ -1,22 +1,177 @@
-﻿from flask import Flask, request, jsonify, send_from_directory
+﻿from flask import Flask, request, send_from_directory, g, Response, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import json
 import datetime
 import re
+import csv
+import io
 import os
-import traceback
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 CORS(app)
 
 DB_PATH = "document_store.db"
 
+# -------------------------
+# 日志：请求线程只把记录放进队列，格式化（含异常堆栈）与写 stderr 由后台线程完成
+# -------------------------
+logger = logging.getLogger(__name__)
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # 同进程内的队列，不必提前格式化，直接传递原始记录
+        return record
+
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+
+def _start_log_listener():
+    global _log_listener
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _log_listener = QueueListener(_log_queue, stream_handler)
+    _log_listener.start()
+
+logger.addHandler(_DeferredQueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_start_log_listener()
+# gunicorn preload 后 fork 出的 worker 没有监听线程，需要重新启动
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_start_log_listener)
+atexit.register(lambda: _log_listener.stop())
+
+# -------------------------
+# JSON 序列化：优先使用 orjson，未安装时回退到标准库 json
+# -------------------------
+# orjson 只支持 64 位整数：解析时超出范围的整数会被静默转成 float，序列化时直接报错
+# 原文中出现 19 位及以上的数字串时改用标准库，保证数值精确（误判只会变慢，不会出错）
+# 19 位负数（如 -9223372036854775809）已低于 i64 下限，所以阈值取 19 而不是 20
+_LONG_NUMBER_RE = re.compile(r"[0-9]{19,}")
+_LONG_NUMBER_RE_BYTES = re.compile(rb"[0-9]{19,}")
+
+def _stdlib_dumps(obj, indent=False):
+    return json.dumps(obj, ensure_ascii=False,
+                      indent=2 if indent else None).encode("utf-8")
+
+def json_dumps(obj, indent=False):
+    """序列化为 UTF-8 bytes（不转义中文）"""
+    if orjson is not None:
+        # OPT_NON_STR_KEYS：与 json.dumps 一致，非 str 键（如 csv.DictReader 把多余列放在 None 键下）转为字符串
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option)
+        except orjson.JSONEncodeError:
+            # 超过 64 位的整数等 orjson 不支持的值，交给标准库处理
+            pass
+    return _stdlib_dumps(obj, indent)
+
+def json_loads(text):
+    """支持 str 或 bytes"""
+    if orjson is not None:
+        pattern = _LONG_NUMBER_RE_BYTES if isinstance(text, (bytes, bytearray)) else _LONG_NUMBER_RE
+        if not pattern.search(text):
+            return orjson.loads(text)
+    return json.loads(text)
+
+def now_iso():
+    """当前本地时间的 ISO 8601 字符串"""
+    return datetime.datetime.now().isoformat()
+
+def ojsonify(obj):
+    """替代 jsonify：直接把 bytes 写入响应"""
+    return app.response_class(json_dumps(obj), mimetype="application/json")
+
+# request.json / request.get_json() 也改用 orjson 解析（需要 Flask >= 2.2）
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
+
+if orjson is not None and DefaultJSONProvider is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            # default 沿用 Flask 对 date / Decimal / UUID / dataclass 的处理
+            try:
+                return orjson.dumps(obj, default=self.default).decode("utf-8")
+            except orjson.JSONEncodeError:
+                return super().dumps(obj, **kwargs)
+
+        def loads(self, s, **kwargs):
+            # 超过 64 位的整数由 json_loads 回退到标准库解析
+            return json_loads(s)
+
+    app.json = OrjsonProvider(app)
+
+# -------------------------
+# 数据库连接：WAL 模式允许读写并发，synchronous=NORMAL 在 WAL 下仍然崩溃安全
+# -------------------------
+_CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
+
+def _connect():
+    """创建连接（autocommit 模式，事务由调用方显式 BEGIN）"""
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False,
+                           cached_statements=256)
+    # journal_mode 是持久属性，其余 PRAGMA 只对当前连接生效，所以每个连接都设置
+    conn.executescript(_CONNECTION_PRAGMAS)
+    # query_documents 等按列名取值，所有连接统一使用 sqlite3.Row
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def get_db():
+    """当前请求复用同一个连接，请求结束时由 close_db 关闭"""
+    db = getattr(g, "_db", None)
+    if db is None:
+        db = g._db = _connect()
+    return db
+
+# 每隔 OPTIMIZE_EVERY 个使用数据库的请求，在关闭连接前执行一次 PRAGMA optimize：
+# SQLite 根据该连接实际执行过的查询，按需重新 ANALYZE，让规划器的统计信息跟上数据量变化
+OPTIMIZE_EVERY = 1000
+_db_request_counter = itertools.count(1)
+
+@app.teardown_appcontext
+def close_db(exc):
+    db = g.pop("_db", None)
+    if db is not None:
+        if next(_db_request_counter) % OPTIMIZE_EVERY == 0:
+            try:
+                db.execute("PRAGMA optimize")
+            except sqlite3.OperationalError:
+                # 写锁被占用时跳过，下一轮再执行
+                logger.warning("PRAGMA optimize skipped", exc_info=True)
+        db.close()
+
 # -------------------------
 # 初始化数据库：只有一个 document 表
 # -------------------------
 def init_database():
-    conn = sqlite3.connect(DB_PATH)
+    conn = _connect()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -24,17 +179,77 @@ def init_database():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             doc_type TEXT,
             identifier TEXT,
-            data TEXT NOT NULL,
+            data BLOB NOT NULL,
             created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    # /api/students 按类型取最新文档，索引有序扫描可以在 LIMIT 处提前结束
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_documents_type_time "
+        "ON documents(doc_type, created_time DESC)"
+    )
+    # /api/chat 按姓名（identifier）精确查找
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_documents_identifier "
+        "ON documents(identifier, created_time DESC)"
+    )
+    _init_fts(cursor)
+    # 首次启动时收集统计信息，之后由 close_db 中的 PRAGMA optimize 维护
+    analyzed = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if not analyzed:
+        cursor.execute("ANALYZE")
     conn.commit()
     conn.close()
 
+# -------------------------
+# 全文索引：documents_fts 以 documents 为外部内容表，由触发器保持同步
+# unicode61 不会切分中文，这里用 trigram 分词，支持任意 >=3 字符的子串匹配
+# -------------------------
+FTS_ENABLED = False
+FTS_MIN_LEN = 3
+
+def _init_fts(cursor):
+    global FTS_ENABLED
+    existed = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='documents_fts'"
+    ).fetchone()
+    try:
+        cursor.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                data, content='documents', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+                INSERT INTO documents_fts(rowid, data) VALUES (new.id, new.data);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+                INSERT INTO documents_fts(documents_fts, rowid, data)
+                VALUES ('delete', old.id, old.data);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+                INSERT INTO documents_fts(documents_fts, rowid, data)
+                VALUES ('delete', old.id, old.data);
+                INSERT INTO documents_fts(rowid, data) VALUES (new.id, new.data);
+            END;
+        ''')
+    except sqlite3.OperationalError:
+        # SQLite 未编译 FTS5 / trigram（< 3.34），继续使用 LIKE
+        logger.warning("FTS5 unavailable, falling back to LIKE search", exc_info=True)
+        return
+    if not existed:
+        # 新建索引时把已有文档导入
+        cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')")
+    FTS_ENABLED = True
+
+def _fts_phrase(text):
+    """把用户输入转成 FTS5 短语，避免标点被当作查询语法"""
+    return '"' + text.replace('"', '""') + '"'
+
 init_database()
 
 # -------------------------
-# DeepSeek API（保持不变）
+# DeepSeek API：复用连接池的 Session，支持普通与流式两种调用
 # -------------------------
 class DeepSeekAPI:
     def __init__(self):
@@ -44,47 +259,110 @@ class DeepSeekAPI:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
-
-    def chat_completion(self, system_prompt, user_message):
-        import requests
-        data = {
+        # 复用 TCP/TLS 连接，避免每次请求都重新握手
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=1)
+        self.session.mount("https://", adapter)
+        # (连接超时, 读取超时)：避免 DeepSeek 过慢时卡死 Flask 工作线程
+        self.timeout = (3.05, 30)
+
+    def _build_request(self, system_prompt, user_message):
+        return {
             "model": "deepseek-chat",
             "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_message}
             ]
         }
+
+    def chat_completion(self, system_prompt, user_message):
+        data = self._build_request(system_prompt, user_message)
         try:
-            response = requests.post(self.base_url, headers=self.headers, json=data)
+            response = self.session.post(self.base_url, json=data, timeout=self.timeout)
             response.raise_for_status()
             return response.json()
         except Exception as e:
             return {"error": str(e)}
 
+    def chat_completion_stream(self, system_prompt, user_message):
+        """流式调用：解析 SSE 帧，逐段产出回复文本；出错时直接抛出异常"""
+        data = self._build_request(system_prompt, user_message)
+        data["stream"] = True
+        with self.session.post(self.base_url, json=data, timeout=self.timeout,
+                               stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # 跳过空行和 ": keep-alive" 之类的注释行
+                if not line.startswith(b"data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]":
+                    break
+                chunk = json_loads(payload)
+                content = chunk["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+
 # -------------------------
 # document 操作函数
 # -------------------------
-def add_document(doc_type, identifier, data_dict):
+def add_document(doc_type, identifier, data_dict, conn=None):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        if conn is None:
+            conn = get_db()
         cursor = conn.cursor()
 
-        json_text = json.dumps(data_dict, ensure_ascii=False)
+        json_bytes = json_dumps(data_dict)
         cursor.execute(
             "INSERT INTO documents(doc_type, identifier, data) VALUES (?,?,?)",
-            (doc_type, identifier, json_text)
+            (doc_type, identifier, json_bytes)
         )
-        conn.commit()
-        new_id = cursor.lastrowid
-        conn.close()
-        return True, new_id
-    except Exception as e:
-        traceback.print_exc()
+        return True, cursor.lastrowid
+    except Exception:
+        logger.exception("add_document failed")
         return False, None
 
-def query_documents(search_text=None, doc_type=None, limit=50):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def add_documents_bulk(conn, docs):
+    """
+    批量插入：docs 为 (doc_type, identifier, data_dict) 的可迭代对象
+    整批放在一个事务里，复用同一条预编译语句
+    单行数据无法序列化时跳过该行并记录下标，其余行照常写入；
+    数据库错误则整体回滚并抛出
+    返回 (新记录的 id 区间 range, 失败行下标列表)
+    """
+    failed = []
+
+    def rows():
+        for index, (doc_type, identifier, data_dict) in enumerate(docs):
+            try:
+                json_bytes = json_dumps(data_dict)
+            except Exception:
+                logger.exception("add_documents_bulk: row %d failed", index)
+                failed.append(index)
+                continue
+            yield doc_type, identifier, json_bytes
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.executemany(
+            "INSERT INTO documents(doc_type, identifier, data) VALUES (?,?,?)",
+            rows()
+        )
+        count = cursor.rowcount
+        # BEGIN IMMEDIATE 持有写锁，本批 id 连续
+        last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return range(last_id - count + 1, last_id + 1), failed
+
+def query_documents(search_text=None, doc_type=None, limit=50, conn=None,
+                    identifier=None):
+    if conn is None:
+        conn = get_db()
     cursor = conn.cursor()
 
     sql = "SELECT id, doc_type, identifier, data, created_time FROM documents WHERE 1=1"
@@ -94,8 +372,16 @@ def query_documents(search_text=None, doc_type=None, limit=50):
         sql += " AND doc_type = ?"
         params.append(doc_type)
 
-    if search_text:
-        sql += " AND data LIKE ?"
+    if identifier:
+        sql += " AND identifier = ?"
+        params.append(identifier)
+
+    if search_text and FTS_ENABLED and len(search_text) >= FTS_MIN_LEN:
+        sql += " AND id IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)"
+        params.append(_fts_phrase(search_text))
+    elif search_text:
+        # trigram 无法匹配过短的词，回退到 LIKE（LIKE 不会匹配 BLOB，需先转成 TEXT）
+        sql += " AND CAST(data AS TEXT) LIKE ?"
         params.append(f"%{search_text}%")
 
     sql += " ORDER BY created_time DESC LIMIT ?"
@@ -103,14 +389,16 @@ def query_documents(search_text=None, doc_type=None, limit=50):
 
     cursor.execute(sql, params)
     rows = cursor.fetchall()
-    conn.close()
 
     result = []
     for r in rows:
         try:
-            data_obj = json.loads(r["data"])
+            # 新数据以 UTF-8 JSON bytes 存储，旧数据为 TEXT，两者都可以直接解析
+            data_obj = json_loads(r["data"])
         except:
             data_obj = r["data"]
+            if isinstance(data_obj, bytes):
+                data_obj = data_obj.decode("utf-8", "replace")
 
         result.append({
             "id": r["id"],
@@ -124,51 +412,163 @@ def query_documents(search_text=None, doc_type=None, limit=50):
 # -------------------------
 # AI 意图识别（保留基本逻辑）
 # -------------------------
+_NAME_RE = re.compile(r'[张李王刘陈杨黄周吴赵][\u4e00-\u9fa5]{1,2}')
+# 关键词均为中文，无需 lower()；一次扫描匹配全部关键词
+_QUERY_RE = re.compile("查询|查找|搜索|有哪些")
+_STORE_RE = re.compile("记录|添加|保存")
+
+# 写入 prompt 的文档条数上限：prompt 越长，token 费用和 API 延迟越高
+LLM_MAX_DOCS = 10
+
+def _compact_for_llm(docs):
+    """只保留 LLM 需要的字段"""
+    return [{"id": d["id"], "type": d["doc_type"], "name": d["identifier"], "data": d["data"]}
+            for d in docs[:LLM_MAX_DOCS]]
+
+# -------------------------
+# 回复缓存：相同的意图、提问和数据库结果直接复用上一次回复，不再请求 DeepSeek
+# 数据库结果参与计算 key，数据有变化时自然失效
+# -------------------------
+class ReplyCache:
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(context, user_input, db_results):
+        return hashlib.blake2b(json_dumps((context, user_input, db_results)),
+                               digest_size=16).digest()
+
+    def get(self, key):
+        with self._lock:
+            reply = self._data.get(key)
+            if reply is not None:
+                self._data.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        with self._lock:
+            self._data[key] = reply
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
 class AIAgent:
     def __init__(self):
         self.api = DeepSeekAPI()
+        self.cache = ReplyCache()
+
+    def _cache_key(self, user_input, db_results, context):
+        # “记录”意图的结果带有写入时间，不会重复命中，不缓存
+        if context != "查询":
+            return None
+        return ReplyCache.make_key(context, user_input, db_results)
 
     def analyze(self, text):
-        text_lower = text.lower()
-        if any(k in text_lower for k in ["查询", "查找", "搜索", "有哪些"]):
+        if _QUERY_RE.search(text):
             return "query"
-        if any(k in text_lower for k in ["记录", "添加", "保存"]):
+        if _STORE_RE.search(text):
             return "store"
         return "query"
 
     def extract_name(self, text):
-        names = re.findall(r'[张李王刘陈杨黄周吴赵]{1}[\u4e00-\u9fa5]{1,2}', text)
-        return names[0] if names else None
-
-    def reply(self, user_input, db_results, context):
-        system_prompt = f"""
+        m = _NAME_RE.search(text)
+        return m.group(0) if m else None
+
+    def build_prompt(self, db_results, context):
+        if isinstance(db_results, list):
+            db_text = json_dumps(_compact_for_llm(db_results), indent=True)
+        else:
+            # “记录”意图下只有刚写入的一条记录，紧凑序列化即可
+            db_text = json_dumps(db_results)
+        return f"""
 你是一个信息系统 AI。以下是数据库返回的数据：
 
-{json.dumps(db_results, ensure_ascii=False, indent=2)}
+{db_text.decode("utf-8")}
 
 用户意图：{context}
 
 请生成自然、简洁、专业的回复。
 """
+
+    def reply(self, user_input, db_results, context):
+        key = self._cache_key(user_input, db_results, context)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            return cached
+
+        system_prompt = self.build_prompt(db_results, context)
         res = self.api.chat_completion(system_prompt, user_input)
         if "error" in res:
             return "AI 服务错误：" + res["error"]
         try:
-            return res["choices"][0]["message"]["content"]
+            content = res["choices"][0]["message"]["content"]
         except:
             return "AI 响应解析失败"
 
+        if key:
+            self.cache.put(key, content)
+        return content
+
+    def reply_stream(self, user_input, db_results, context):
+        """与 reply 相同，但逐段产出回复文本"""
+        key = self._cache_key(user_input, db_results, context)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            yield cached
+            return
+
+        system_prompt = self.build_prompt(db_results, context)
+        parts = []
+        try:
+            for content in self.api.chat_completion_stream(system_prompt, user_input):
+                parts.append(content)
+                yield content
+        except Exception as e:
+            yield "AI 服务错误：" + str(e)
+            return
+
+        if key:
+            self.cache.put(key, "".join(parts))
+
 agent = AIAgent()
 
 # -------------------------
 # API：前端接口保持不变
 # -------------------------
 
+# /api/students 响应缓存：(etag, body)
+# documents 使用 AUTOINCREMENT，sqlite_sequence 中的 seq 每次插入都会递增，
+# 以它作为版本号，其他 worker 进程写入后也能失效
+_students_cache = (None, None)
+
+def _documents_version(conn=None):
+    if conn is None:
+        conn = get_db()
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'documents'"
+    ).fetchone()
+    return row[0] if row else 0
+
 @app.route('/api/students', methods=['GET'])
 def api_students():
     """返回 doc_type='student' 的文档"""
-    docs = query_documents(doc_type="student", limit=200)
-    return jsonify({"status": "success", "students": docs})
+    global _students_cache
+    etag = f"students-{_documents_version()}"
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        cached_etag, body = _students_cache
+        if cached_etag != etag:
+            docs = query_documents(doc_type="student", limit=200)
+            body = json_dumps({"status": "success", "students": docs})
+            _students_cache = (etag, body)
+        response = app.response_class(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/record', methods=['POST'])
 def api_record():
@@ -181,17 +581,60 @@ def api_record():
         "student_name": student_name,
         "record_type": record_type,
         "content": content,
-        "time": datetime.datetime.now().isoformat()
+        "time": now_iso()
     }
 
     ok, _id = add_document("record", student_name, record)
     if ok:
-        return jsonify({"status": "success", "message": "记录已添加"})
+        return ojsonify({"status": "success", "message": "记录已添加"})
     else:
-        return jsonify({"status": "error", "message": "添加失败"})
-
-import csv
-import io
+        return ojsonify({"status": "error", "message": "添加失败"})
+
+def json_import_rows(items):
+    """JSON 数组 -> (doc_type, identifier, data_dict)，逐条产出供 executemany 使用"""
+    for it in items:
+        doc_type = it.get("doc_type")
+        identifier = it.get("identifier")
+
+        # data 字段自动构建
+        if "data" in it and isinstance(it["data"], dict):
+            data_dict = it["data"]
+        else:
+            # 其余字段都归到 data
+            data_dict = {k: v for (k, v) in it.items()
+                         if k not in ("doc_type", "identifier")}
+        yield doc_type, identifier, data_dict
+
+def csv_import_rows(reader):
+    """CSV 行 -> (doc_type, identifier, data_dict)，逐条产出供 executemany 使用"""
+    for row in reader:
+        doc_type = row.get("doc_type") or None
+        identifier = row.get("identifier") or None
+
+        # 其它列全部作为 data 字段
+        data_dict = {k: v for (k, v) in row.items()
+                     if k not in ("doc_type", "identifier")}
+        yield doc_type, identifier, data_dict
+
+def import_details(new_ids, failed):
+    """
+    导入明细：成功行默认只返回前 max_details 条（默认 100），?verbose=1 返回全部；
+    失败行（index 为输入中的下标，从 0 开始）总是全部返回
+    不再回显原始数据，调用方手里已有输入
+    """
+    if request.args.get("verbose") != "1":
+        max_details = request.args.get("max_details", 100, type=int)
+        new_ids = new_ids[:max(max_details, 0)]
+    details = [{"status": "ok", "id": new_id} for new_id in new_ids]
+    details.extend({"status": "fail", "index": index} for index in failed)
+    return details
+
+def import_response(new_ids, failed):
+    return ojsonify({
+        "status": "success",
+        "summary": {"success": len(new_ids), "fail": len(failed)},
+        "details": import_details(new_ids, failed)
+    })
 
 @app.route('/api/import', methods=['POST'])
 def api_import():
@@ -208,113 +651,86 @@ def api_import():
         if request.is_json:
             items = request.get_json()
             if not isinstance(items, list):
-                return jsonify({"status": "error", "message": "JSON 必须是数组"}), 400
-
-            results = []
-            succ = 0
-            fail = 0
-
-            for it in items:
-                doc_type = it.get("doc_type")
-                identifier = it.get("identifier")
-
-                # data 字段自动构建
-                if "data" in it and isinstance(it["data"], dict):
-                    data_dict = it["data"]
-                else:
-                    # 其余字段都归到 data
-                    data_dict = {k: v for (k, v) in it.items()
-                                 if k not in ("doc_type", "identifier")}
-
-                ok, new_id = add_document(doc_type, identifier, data_dict)
-                if ok:
-                    succ += 1
-                    results.append({"item": it, "status": "ok", "id": new_id})
-                else:
-                    fail += 1
-                    results.append({"item": it, "status": "fail"})
-
-            return jsonify({
-                "status": "success",
-                "summary": {"success": succ, "fail": fail},
-                "details": results
-            })
+                return ojsonify({"status": "error", "message": "JSON 必须是数组"}), 400
+
+            new_ids, failed = add_documents_bulk(get_db(), json_import_rows(items))
+            return import_response(new_ids, failed)
 
         # ---------------------------
         # 情况 2：CSV 文件上传
         # ---------------------------
         if "file" in request.files:
             file = request.files["file"]
-            stream = io.StringIO(file.read().decode("utf-8"))
+            # 边读边解析，不把整个文件读入内存
+            stream = io.TextIOWrapper(file.stream, encoding="utf-8", newline="")
             reader = csv.DictReader(stream)
 
-            results = []
-            succ = 0
-            fail = 0
-
-            for row in reader:
-                doc_type = row.get("doc_type") or None
-                identifier = row.get("identifier") or None
-
-                # 其它列全部作为 data 字段
-                data_dict = {k: v for (k, v) in row.items()
-                             if k not in ("doc_type", "identifier")}
-
-                ok, new_id = add_document(doc_type, identifier, data_dict)
-
-                if ok:
-                    succ += 1
-                    results.append({"row": row, "status": "ok", "id": new_id})
-                else:
-                    fail += 1
-                    results.append({"row": row, "status": "fail"})
-
-            return jsonify({
-                "status": "success",
-                "summary": {"success": succ, "fail": fail},
-                "details": results
-            })
+            new_ids, failed = add_documents_bulk(get_db(), csv_import_rows(reader))
+            return import_response(new_ids, failed)
 
         # 如果两种方式都不是
-        return jsonify({
+        return ojsonify({
             "status": "error",
             "message": "请上传 JSON 数组或 CSV 文件"
         }), 400
 
     except Exception as e:
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": str(e)}), 500
+        logger.exception("api_import failed")
+        return ojsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     user_msg = request.json.get("message", "")
+    db_result, context = handle_chat_message(user_msg)
+
+    reply = agent.reply(user_msg, db_result, context)
+
+    return ojsonify({"status": "success", "response": reply})
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """与 /api/chat 相同，但以 SSE（text/event-stream）逐段返回回复"""
+    user_msg = request.json.get("message", "")
+    db_result, context = handle_chat_message(user_msg)
+
+    def generate():
+        for content in agent.reply_stream(user_msg, db_result, context):
+            yield b"data: " + json_dumps({"content": content}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+def handle_chat_message(user_msg):
+    """识别意图并完成查询/存储，返回 (db_result, context)"""
     intent = agent.analyze(user_msg)
     name = agent.extract_name(user_msg)
 
     db_result = []
 
     if intent == "query":
-        db_result = query_documents(search_text=name, limit=20)
+        if name:
+            db_result = query_documents(identifier=name, limit=LLM_MAX_DOCS)
+        if not db_result:
+            # 没有 identifier 命中（例如导入时未填写 identifier），回退到全文检索
+            db_result = query_documents(search_text=name, limit=LLM_MAX_DOCS)
         context = "查询"
     else:
         # 存储
         record = {
             "student_name": name,
             "content": user_msg,
-            "time": datetime.datetime.now().isoformat()
+            "time": now_iso()
         }
         add_document("record", name, record)
         db_result = record
         context = "记录"
 
-    reply = agent.reply(user_msg, db_result, context)
-
-    return jsonify({"status": "success", "response": reply})
+    return db_result, context
 
 @app.route('/api/health')
 def health():
-    return jsonify({"status": "ok", "time": datetime.datetime.now().isoformat()})
+    return ojsonify({"status": "ok", "time": now_iso()})
 
 @app.route('/')
 def index():
@@ -325,4 +741,5 @@ def static_files(path):
     return send_from_directory('.', path)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # 开发调试用；生产环境请使用 gunicorn（见 gunicorn_conf.py）
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,88 @@
+import importlib.util
+import io
+import os
+
+import pytest
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # DB_PATH 是相对路径，导入前切换到临时目录，避免写入真实数据库
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("main", MAIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+
+def post_csv(client, text):
+    data = {"file": (io.BytesIO(text.encode("utf-8")), "import.csv")}
+    return client.post("/api/import", data=data)
+
+
+def test_import_csv_row_with_extra_fields(client):
+    # 多出表头的列被 csv.DictReader 放在 None 键下
+    res = post_csv(client, "doc_type,identifier,name\nstudent,张三,x,EXTRA\n")
+
+    assert res.status_code == 200
+    assert res.get_json()["summary"]["success"] == 1
+
+    students = client.get("/api/students").get_json()["students"]
+    assert students[0]["identifier"] == "张三"
+    assert students[0]["data"] == {"name": "x", "null": ["EXTRA"]}
+
+
+def test_import_skips_rows_that_cannot_be_serialized(main, client, monkeypatch):
+    json_dumps = main.json_dumps
+
+    def failing_dumps(obj, indent=False):
+        if obj.get("name") == "bad":
+            raise TypeError("not serializable")
+        return json_dumps(obj, indent)
+
+    monkeypatch.setattr(main, "json_dumps", failing_dumps)
+    res = post_csv(client, "doc_type,identifier,name\n"
+                           "student,张三,ok\nstudent,李四,bad\nstudent,王五,ok\n")
+
+    body = res.get_json()
+    assert res.status_code == 200
+    assert body["summary"] == {"success": 2, "fail": 1}
+    assert {"status": "fail", "index": 1} in body["details"]
+    names = [d["identifier"] for d in client.get("/api/students").get_json()["students"]]
+    assert sorted(names) == ["张三", "王五"]
+
+
+@pytest.mark.parametrize("big", [
+    123456789012345678901234567890,
+    # 只有 19 位数字，但低于 i64 下限
+    -2 ** 63 - 1,
+])
+def test_import_json_keeps_integers_wider_than_64_bits(client, big):
+    res = client.post("/api/import", data='[{"doc_type": "student", "identifier": "张三", '
+                                          '"sid": %d}]' % big,
+                      content_type="application/json")
+
+    assert res.status_code == 200
+    assert res.get_json()["summary"] == {"success": 1, "fail": 0}
+    student = client.get("/api/students").get_json()["students"][0]
+    assert student["data"]["sid"] == big
+
+
+def test_query_documents_accepts_own_connection(main):
+    conn = main._connect()
+    try:
+        ok, new_id = main.add_document("student", "张三", {"age": 18}, conn=conn)
+        docs = main.query_documents(doc_type="student", conn=conn)
+    finally:
+        conn.close()
+
+    assert ok
+    assert docs[0]["id"] == new_id
+    assert docs[0]["data"] == {"age": 18}
@@ -0,0 +1,7 @@
+"""
+WSGI 入口，供生产服务器加载：
+    gunicorn -c gunicorn_conf.py wsgi:app
+Windows 下 gunicorn 不可用，可以改用 waitress：
+    waitress-serve --host=0.0.0.0 --port=5000 --threads=8 wsgi:app
+"""
+from main import app